@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+"""
+    BurnScan ticket API client
+    Copyright (C) 2010 Ben Sarsgard
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import base64
+import binascii
+import json
+import time
+
+import certifi
+import nacl.encoding
+import nacl.exceptions
+import pycurl
+
+try:
+    # Python 3
+    from urllib.parse import urlencode
+    from io import BytesIO
+except ImportError:
+    # Python 2
+    from urllib import urlencode
+    from StringIO import StringIO as BytesIO
+
+from nacl.public import Box, PrivateKey, PublicKey
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_TIMEOUT = 20
+
+class ApiClient(object):
+    def __init__(self, api_path, client_ident, client_private_key, server_public_key,
+            connect_timeout=DEFAULT_CONNECT_TIMEOUT, timeout=DEFAULT_TIMEOUT):
+        self.api_path = api_path
+        self.client_ident = client_ident
+        self.client_private_key = PrivateKey(client_private_key, encoder=nacl.encoding.Base64Encoder)
+        self.server_public_key = PublicKey(server_public_key, encoder=nacl.encoding.Base64Encoder)
+        self.box_server = Box(self.client_private_key, self.server_public_key)
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.request_seconds = 0.0
+
+    def query_server(self, request):
+        json_request = json.dumps(request)
+        bin_request = self.box_server.encrypt(json_request.encode('utf-8'))
+        io_buffer = BytesIO()
+        curl_query = pycurl.Curl()
+        curl_query.setopt(curl_query.URL, self.api_path)
+        b64_request = base64.b64encode(bin_request)
+        post_data = {'i': self.client_ident, 'r': b64_request}
+        post_fields = urlencode(post_data)
+        curl_query.setopt(curl_query.POSTFIELDS, post_fields)
+        curl_query.setopt(curl_query.WRITEDATA, io_buffer)
+        curl_query.setopt(curl_query.CAINFO, certifi.where())
+        # the update runs on the UI thread, so a dead link must not hang the scanner
+        curl_query.setopt(curl_query.CONNECTTIMEOUT, self.connect_timeout)
+        curl_query.setopt(curl_query.TIMEOUT, self.timeout)
+        request_start = time.time()
+        try:
+            curl_query.perform()
+        except pycurl.error:
+            return False
+        finally:
+            self.request_seconds += time.time() - request_start
+            self.bytes_sent += int(curl_query.getinfo(curl_query.SIZE_UPLOAD))
+            self.bytes_received += int(curl_query.getinfo(curl_query.SIZE_DOWNLOAD))
+            curl_query.close()
+        try:
+            cip_response = base64.b64decode(io_buffer.getvalue())
+            bin_response = self.box_server.decrypt(cip_response)
+            json_response = bin_response.decode('utf-8')
+            obj_response = json.loads(json_response)
+        except (binascii.Error, nacl.exceptions.CryptoError, ValueError):
+            # truncated or garbled response; try again on the next update
+            return False
+        return obj_response
+
+def count_tickets(ticket_db, schemas=('main',)):
+    tickets_sold = 0
+    tickets_used = 0
+
+    cursor = ticket_db.cursor()
+    sql_sold = '''SELECT COUNT(*) FROM (SELECT DISTINCT `ticket_number`, `ticket_code`, `tier_code` FROM `{db}`.`tickets`)'''
+    sql_used = '''SELECT COUNT(DISTINCT `ticket_id`) FROM `{db}`.`checkins`'''
+    for db in schemas:
+        cursor.execute(sql_sold.format(db=db))
+        res_sold = cursor.fetchone()
+        tickets_sold += int(res_sold[0])
+        cursor.execute(sql_used.format(db=db))
+        res_used = cursor.fetchone()
+        tickets_used += int(res_used[0])
+    cursor.close()
+    return tickets_sold, tickets_used
+
+def update_tickets(ticket_db, api_client, shards=None):
+    if shards is None:
+        schemas = ['main']
+    else:
+        schemas = shards.schemas()
+    last_cursor = ticket_db.cursor()
+    sql_last = '''SELECT `id` FROM `{db}`.`tickets` ORDER BY `id` DESC LIMIT 1'''
+    ticket_id = 0
+    for db in schemas:
+        last_cursor.execute(sql_last.format(db=db))
+        last_ticket = last_cursor.fetchone()
+        if last_ticket is not None:
+            ticket_id = max(ticket_id, last_ticket[0])
+    last_cursor.close()
+    arr_request = {'command': 'update', 'id': ticket_id}
+    api_response = api_client.query_server(arr_request)
+    if api_response is False:
+        return False
+    if len(api_response) < 1:
+        return True
+    # resolve every shard before inserting; ATTACH can't run mid-transaction
+    ticket_schemas = {}
+    for ticket in api_response:
+        tier_code = ticket['tier_code']
+        if tier_code not in ticket_schemas:
+            if shards is None:
+                ticket_schemas[tier_code] = 'main'
+            else:
+                ticket_schemas[tier_code] = shards.schema_for_tier(tier_code, create=True)
+    insert_template = '''INSERT INTO `{db}`.`tickets`
+        (`id`, `import_id`, `ticket_number`, `ticket_code`,`tier_id`,
+        `tier_code`, `tier_label`, `purchase_date`, `purchase_email`,
+        `purchase_name`, `assigned_email`, `waiver_name`, `waiver_state`,
+        `waiver_emergency`)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    update_cursor = ticket_db.cursor()
+    for ticket in api_response:
+        update_cursor.execute(insert_template.format(db=ticket_schemas[ticket['tier_code']]),
+            (ticket['id'], ticket['import_id'], ticket['ticket_number'],
+            ticket['ticket_code'], ticket['tier_id'], ticket['tier_code'],
+            ticket['tier_label'], ticket['purchase_date'], ticket['purchase_email'],
+            ticket['purchase_name'], ticket['assigned_email'], ticket['waiver_name'],
+            ticket['waiver_state'], ticket['waiver_emergency']))
+    update_cursor.close()
+    ticket_db.commit()
+    return True
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+
+"""
+    BurnScan fake ticket API server
+    Copyright (C) 2010 Ben Sarsgard
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import base64
+import binascii
+import configparser
+import json
+import sqlite3
+import threading
+import time
+
+import nacl.encoding
+import nacl.exceptions
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from nacl.public import Box, PrivateKey
+
+CFG_SECTION_GENERAL = 'General'
+CFG_SECTION_SECURITY = 'Security'
+CFG_SECTION_DATA = 'Data'
+
+TEST_CLIENT_IDENT = 'test_sparklepony'
+
+# latency is per response in seconds, bandwidth in bytes per second (0 for
+# unlimited), hang holds the connection open without answering, truncate
+# sends only that fraction of the body as a complete response, and drop sends
+# that fraction of the body and then closes the connection mid-transfer
+NETWORK_PROFILES = {
+    'local': {'latency': 0.0, 'bandwidth': 0, 'hang': 0.0, 'truncate': 0.0, 'drop': 0.0},
+    'wifi': {'latency': 0.05, 'bandwidth': 1000000, 'hang': 0.0, 'truncate': 0.0, 'drop': 0.0},
+    'cellular': {'latency': 0.3, 'bandwidth': 100000, 'hang': 0.0, 'truncate': 0.0, 'drop': 0.0},
+    'satellite': {'latency': 0.8, 'bandwidth': 20000, 'hang': 0.0, 'truncate': 0.0, 'drop': 0.0},
+    'timeout': {'latency': 0.0, 'bandwidth': 0, 'hang': 60.0, 'truncate': 0.0, 'drop': 0.0},
+    'truncated': {'latency': 0.05, 'bandwidth': 0, 'hang': 0.0, 'truncate': 0.5, 'drop': 0.0},
+    'dropped': {'latency': 0.05, 'bandwidth': 0, 'hang': 0.0, 'truncate': 0.0, 'drop': 0.5},
+}
+
+DEFAULT_PROFILE = 'local'
+DEFAULT_TICKET_COUNT = 5000
+DEFAULT_BATCH_SIZE = 1000
+
+SQL_CREATE_TICKETS = '''CREATE TABLE IF NOT EXISTS `tickets` (
+    `id` INTEGER PRIMARY KEY,
+    `import_id` INTEGER,
+    `ticket_number` INTEGER,
+    `ticket_code` INTEGER,
+    `tier_id` INTEGER,
+    `tier_code` INTEGER,
+    `tier_label` TEXT,
+    `purchase_date` TEXT,
+    `purchase_email` TEXT,
+    `purchase_name` TEXT,
+    `assigned_email` TEXT,
+    `waiver_name` TEXT,
+    `waiver_state` TEXT,
+    `waiver_emergency` TEXT
+)'''
+
+SQL_CREATE_CHECKINS = '''CREATE TABLE IF NOT EXISTS `checkins` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `ticket_id` INTEGER,
+    `date` TEXT,
+    `wristband` INTEGER,
+    `ticket_number` INTEGER,
+    `ticket_code` INTEGER,
+    `tier_code` INTEGER
+)'''
+
+TIERS = [(1, 'General'), (2, 'Low Income'), (3, 'Volunteer'), (4, 'Comp')]
+
+def generate_tickets(count):
+    tickets = []
+    for ticket_id in range(1, count + 1):
+        tier_code, tier_label = TIERS[ticket_id % len(TIERS)]
+        tickets.append({
+            'id': ticket_id,
+            'import_id': 1,
+            'ticket_number': ticket_id % 100000,
+            'ticket_code': (ticket_id * 7919) % 10000,
+            'tier_id': tier_code,
+            'tier_code': tier_code,
+            'tier_label': tier_label,
+            'purchase_date': '2026-06-01 12:00:00',
+            'purchase_email': 'buyer%i@example.com' % ticket_id,
+            'purchase_name': 'Buyer %i' % ticket_id,
+            'assigned_email': '',
+            'waiver_name': 'Participant %i' % ticket_id,
+            'waiver_state': 'NV',
+            'waiver_emergency': 'Emergency Contact %i, 555-0100' % ticket_id,
+        })
+    return tickets
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_POST(self):
+        fake_server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        post_data = parse_qs(self.rfile.read(length).decode('ascii'))
+        client_ident = post_data.get('i', [''])[0]
+        box_client = fake_server.client_boxes.get(client_ident)
+        if box_client is None:
+            self.send_error(403)
+            return
+        try:
+            cip_request = base64.b64decode(post_data['r'][0])
+            request = json.loads(box_client.decrypt(cip_request).decode('utf-8'))
+        except (KeyError, binascii.Error, nacl.exceptions.CryptoError, ValueError):
+            self.send_error(400)
+            return
+
+        response = fake_server.handle_request(request)
+        bin_response = box_client.encrypt(json.dumps(response).encode('utf-8'))
+        body = base64.b64encode(bin_response)
+        try:
+            self.send_profiled(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client timed out and hung up mid-transfer
+            self.close_connection = True
+
+    def send_profiled(self, body):
+        profile = self.server.profile
+        if profile['hang']:
+            time.sleep(profile['hang'])
+            self.close_connection = True
+            return
+        if profile['latency']:
+            time.sleep(profile['latency'])
+        if profile['truncate']:
+            # the length matches, so the client sees a complete but cut-off body
+            body = body[:int(len(body) * profile['truncate'])]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if profile['drop']:
+            body = body[:int(len(body) * profile['drop'])]
+            self.close_connection = True
+        self.write_throttled(body, profile['bandwidth'])
+
+    def write_throttled(self, body, bandwidth):
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        # send in tenth-of-a-second slices to approximate a capped link
+        chunk_size = max(1, bandwidth // 10)
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(float(len(chunk)) / bandwidth)
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), profile=DEFAULT_PROFILE,
+            ticket_count=DEFAULT_TICKET_COUNT, batch_size=DEFAULT_BATCH_SIZE, verbose=False):
+        ThreadingHTTPServer.__init__(self, address, FakeApiHandler)
+        self.profile = NETWORK_PROFILES[profile]
+        self.tickets = generate_tickets(ticket_count)
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.server_private_key = PrivateKey.generate()
+        self.client_private_key = PrivateKey.generate()
+        self.client_ident = TEST_CLIENT_IDENT
+        self.client_boxes = {
+            self.client_ident: Box(self.server_private_key, self.client_private_key.public_key),
+        }
+        self.thread = None
+
+    @property
+    def api_path(self):
+        return 'http://%s:%i/' % self.server_address[:2]
+
+    def encoded_keys(self):
+        return {
+            'client_ident': self.client_ident,
+            'client_private_key': self.client_private_key.encode(nacl.encoding.Base64Encoder).decode('ascii'),
+            'client_public_key': self.client_private_key.public_key.encode(nacl.encoding.Base64Encoder).decode('ascii'),
+            'server_public_key': self.server_private_key.public_key.encode(nacl.encoding.Base64Encoder).decode('ascii'),
+        }
+
+    def handle_request(self, request):
+        if request.get('command') != 'update':
+            return []
+        last_id = int(request.get('id', 0))
+        # ids are 1..n, so the delta starts right at the client's last id
+        delta = self.tickets[last_id:]
+        if self.batch_size:
+            delta = delta[:self.batch_size]
+        return delta
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+def create_database(database_path):
+    ticket_db = sqlite3.connect(database_path)
+    try:
+        ticket_db.execute(SQL_CREATE_TICKETS)
+        ticket_db.execute(SQL_CREATE_CHECKINS)
+        ticket_db.commit()
+    finally:
+        ticket_db.close()
+
+def write_config(fake_server, cfg_path, database_path):
+    config = configparser.RawConfigParser()
+    config.add_section(CFG_SECTION_SECURITY)
+    for key, value in sorted(fake_server.encoded_keys().items()):
+        config.set(CFG_SECTION_SECURITY, key, value)
+    config.add_section(CFG_SECTION_GENERAL)
+    config.set(CFG_SECTION_GENERAL, 'sound_accept', 'accept.wav')
+    config.set(CFG_SECTION_GENERAL, 'sound_reject', 'reject.wav')
+    config.set(CFG_SECTION_GENERAL, 'sound_error', 'error.wav')
+    config.add_section(CFG_SECTION_DATA)
+    config.set(CFG_SECTION_DATA, 'database_path', database_path)
+    config.set(CFG_SECTION_DATA, 'api_path', fake_server.api_path)
+    with open(cfg_path, 'w') as cfg_file:
+        config.write(cfg_file)
+
+argparser = argparse.ArgumentParser(description='BurnScan Fake API Server')
+argparser.add_argument('--port', type=int, default=8080, help='Port to listen on.')
+argparser.add_argument('--profile', choices=sorted(NETWORK_PROFILES), default=DEFAULT_PROFILE, help='Network conditions to simulate.')
+argparser.add_argument('--tickets', type=int, default=DEFAULT_TICKET_COUNT, help='Number of tickets to serve.')
+argparser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Tickets per update response, 0 for all.')
+argparser.add_argument('--write-config', default='BurnScan_test.cfg', help='Write a client config with the test keys to this file.')
+argparser.add_argument('--database', default='tickets_test.db', help='Test database to create and put in the written config.')
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    fake_server = FakeApiServer(('127.0.0.1', args.port), profile=args.profile,
+        ticket_count=args.tickets, batch_size=args.batch_size, verbose=True)
+    create_database(args.database)
+    write_config(fake_server, args.write_config, args.database)
+    print("Serving {0} tickets on {1} ({2}); run bs_form.py --config {3}".format(
+        args.tickets, fake_server.api_path, args.profile, args.write_config))
+    try:
+        fake_server.serve_forever()
+    except KeyboardInterrupt:
+        fake_server.server_close()
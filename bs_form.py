@@ -19,17 +19,12 @@
 """
 
 import argparse
-import base64
-import json
 import os.path
 import re
 import sqlite3
 import sys
 import time
 
-import certifi
-import nacl.utils
-import pycurl
 import pygame
 import wx
 import wx.adv
@@ -37,18 +32,15 @@ import wx.adv
 try:
     # Python 3
     import configparser
-    from urllib.parse import urlencode
-    from io import BytesIO
 except ImportError:
     # Python 2
     import ConfigParser as configparser
-    from urllib import urlencode
-    from StringIO import StringIO as BytesIO
 
 from datetime import datetime
 from xml.dom.minidom import Node
 
-from nacl.public import Box, PrivateKey, PublicKey
+import bs_api
+import bs_shards
 
 CFG_PATH = 'BurnScan.cfg'
 
@@ -65,6 +57,11 @@ CFG_SERVER_PUBLIC_KEY = 'server_public_key'
 CFG_SECTION_DATA = 'Data'
 CFG_DATABASE_PATH = 'database_path'
 CFG_API_PATH = 'api_path'
+CFG_API_TIMEOUT = 'api_timeout'
+CFG_SHARD_DIR = 'shard_dir'
+CFG_SHARD_EVENT = 'shard_event'
+CFG_SHARD_BY_TIER = 'shard_by_tier'
+CFG_SHARD_LEGACY_EVENT = 'shard_legacy_event'
 
 STATUS_NONE = 0
 STATUS_ACCEPT = 1
@@ -90,6 +87,52 @@ class MainWindow(wx.Frame):
 
         self.ticket_db.row_factory = sqlite3.Row
 
+        # attach the active event's shards, if the data is partitioned
+        if self.config.has_option(CFG_SECTION_DATA, CFG_SHARD_DIR):
+            shard_dir = self.config.get(CFG_SECTION_DATA, CFG_SHARD_DIR)
+            if not self.config.has_option(CFG_SECTION_DATA, CFG_SHARD_EVENT):
+                print("Error loading config: shard_dir is set but shard_event is missing")
+                sys.exit()
+            shard_event = self.config.get(CFG_SECTION_DATA, CFG_SHARD_EVENT)
+            if self.config.has_option(CFG_SECTION_DATA, CFG_SHARD_BY_TIER):
+                shard_by_tier = self.config.getboolean(CFG_SECTION_DATA, CFG_SHARD_BY_TIER)
+            else:
+                shard_by_tier = False
+            if self.config.has_option(CFG_SECTION_DATA, CFG_SHARD_LEGACY_EVENT):
+                shard_legacy_event = self.config.get(CFG_SECTION_DATA, CFG_SHARD_LEGACY_EVENT)
+            else:
+                shard_legacy_event = bs_shards.DEFAULT_LEGACY_EVENT
+        else:
+            shard_dir = shard_event = None
+            shard_by_tier = False
+            shard_legacy_event = bs_shards.DEFAULT_LEGACY_EVENT
+
+        if shard_dir is not None:
+            try:
+                bs_shards.check_event_name(shard_event)
+                bs_shards.check_event_name(shard_legacy_event)
+            except ValueError as err:
+                print("Error loading config: {0}".format(err))
+                sys.exit()
+
+        if self.args.archive_event:
+            if shard_dir is None or self.args.archive_event == shard_event:
+                print("Error archiving event: only inactive events in shard_dir can be archived")
+                sys.exit()
+            try:
+                bs_shards.check_event_name(self.args.archive_event)
+                bs_shards.archive_event(shard_dir, self.args.archive_event)
+            except Exception as err:
+                print("Error archiving event: {0}".format(err))
+                sys.exit()
+
+        try:
+            self.shards = bs_shards.ShardSet(self.ticket_db, shard_dir, shard_event,
+                shard_by_tier, shard_legacy_event)
+        except Exception as err:
+            print("Error loading database shards: {0}".format(err))
+            sys.exit()
+
         # handle arguments
         if self.args.flush_tickets:
             self.flush_tickets()
@@ -98,18 +141,22 @@ class MainWindow(wx.Frame):
         if self.args.flush_all:
             self.flush_all()
 
-        # configure encryption keys
-        self.client_ident = self.config.get(CFG_SECTION_SECURITY, CFG_CLIENT_IDENT)
-        self.client_private_key = PrivateKey(self.config.get(CFG_SECTION_SECURITY, CFG_CLIENT_PRIVATE_KEY), encoder=nacl.encoding.Base64Encoder)
-        self.server_public_key = PublicKey(self.config.get(CFG_SECTION_SECURITY, CFG_SERVER_PUBLIC_KEY), encoder=nacl.encoding.Base64Encoder)
-
         # configure sounds
         self.sound_accept = self.config.get(CFG_SECTION_GENERAL, CFG_SOUND_ACCEPT)
         self.sound_reject = self.config.get(CFG_SECTION_GENERAL, CFG_SOUND_REJECT)
         self.sound_error = self.config.get(CFG_SECTION_GENERAL, CFG_SOUND_ERROR)
 
-        # configure api path
+        # configure api path and encryption keys
         self.api_path = self.config.get(CFG_SECTION_DATA, CFG_API_PATH)
+        if self.config.has_option(CFG_SECTION_DATA, CFG_API_TIMEOUT):
+            api_timeout = self.config.getint(CFG_SECTION_DATA, CFG_API_TIMEOUT)
+        else:
+            api_timeout = bs_api.DEFAULT_TIMEOUT
+        self.api_client = bs_api.ApiClient(self.api_path,
+            self.config.get(CFG_SECTION_SECURITY, CFG_CLIENT_IDENT),
+            self.config.get(CFG_SECTION_SECURITY, CFG_CLIENT_PRIVATE_KEY),
+            self.config.get(CFG_SECTION_SECURITY, CFG_SERVER_PUBLIC_KEY),
+            timeout=api_timeout)
 
         # set api timer
         self.api_timer = wx.Timer(self)
@@ -241,7 +288,7 @@ class MainWindow(wx.Frame):
 
     def load_config(self):
         self.config = configparser.RawConfigParser()
-        self.config.read(CFG_PATH)
+        self.config.read(self.args.config)
 
     def play_sound_accept(self):
         pygame.mixer.Sound(self.sound_accept).play()
@@ -273,18 +320,20 @@ class MainWindow(wx.Frame):
 
     def flush_tickets(self):
         cursor = self.ticket_db.cursor()
-        sql_flush = '''DELETE FROM `tickets`'''
-        cursor.execute(sql_flush)
+        sql_flush = '''DELETE FROM `{db}`.`tickets`'''
+        for db in self.shards.schemas():
+            cursor.execute(sql_flush.format(db=db))
         cursor.close()
         self.ticket_db.commit()
         return True
 
     def flush_wristbands(self):
         cursor = self.ticket_db.cursor()
-        sql_flush = '''DELETE FROM `checkins`'''
-        cursor.execute(sql_flush)
-        sql_counter = '''UPDATE `sqlite_sequence` SET `seq` = 0 WHERE `name` = 'checkins' LIMIT 1'''
-        cursor.execute(sql_counter)
+        sql_flush = '''DELETE FROM `{db}`.`checkins`'''
+        sql_counter = '''UPDATE `{db}`.`sqlite_sequence` SET `seq` = 0 WHERE `name` = 'checkins' LIMIT 1'''
+        for db in self.shards.schemas():
+            cursor.execute(sql_flush.format(db=db))
+            cursor.execute(sql_counter.format(db=db))
         cursor.close()
         self.ticket_db.commit()
         return True
@@ -317,12 +366,14 @@ class MainWindow(wx.Frame):
             return -1
 
         cursor = self.ticket_db.cursor()
-        sql_wristband_search = '''SELECT COUNT(*) FROM `checkins` WHERE `wristband` = ? LIMIT 1'''
-        cursor.execute(sql_wristband_search, (wristband_id,))
-        wristband_count = cursor.fetchone()
+        sql_wristband_search = '''SELECT COUNT(*) FROM `{db}`.`checkins` WHERE `wristband` = ? LIMIT 1'''
+        wristband_count = 0
+        for db in self.shards.schemas():
+            cursor.execute(sql_wristband_search.format(db=db), (wristband_id,))
+            wristband_count += int(cursor.fetchone()[0])
         cursor.close()
 
-        if int(wristband_count[0]) != 0:
+        if wristband_count != 0:
             wristband_error = 'Wristband ID "%s" already entered!' % (wristband_id)
             error_dialog = wx.MessageDialog(self, wristband_error,'Error', wx.OK|wx.ICON_ERROR|wx.STAY_ON_TOP)
             error_dialog.ShowModal()
@@ -334,7 +385,7 @@ class MainWindow(wx.Frame):
         query_string = '%%%s%%' % searchfilter
         cursor = self.ticket_db.cursor()
         sql_search = '''SELECT *
-            FROM `tickets` AS `tix1`
+            FROM `{db}`.`tickets` AS `tix1`
             WHERE
                 (
                     `tix1`.`purchase_email` LIKE ?
@@ -345,7 +396,7 @@ class MainWindow(wx.Frame):
                 AND ((
                     `tix1`.`id` = (
                         SELECT MAX(`tix2`.`id`)
-                        FROM `tickets` as `tix2`
+                        FROM `{db}`.`tickets` as `tix2`
                         WHERE
                             `tix2`.`ticket_number` = `tix1`.`ticket_number`
                             AND `tix2`.`ticket_code` = `tix1`.`ticket_code`
@@ -354,7 +405,7 @@ class MainWindow(wx.Frame):
                     AND (
                         (
                             SELECT `chex1`.`ticket_id`
-                            FROM `checkins` AS `chex1`
+                            FROM `{db}`.`checkins` AS `chex1`
                             WHERE
                                 `chex1`.`ticket_number` = `tix1`.`ticket_number`
                                 AND `chex1`.`ticket_code` = `tix1`.`ticket_code`
@@ -363,7 +414,7 @@ class MainWindow(wx.Frame):
                         ) = `tix1`.`id`
                         OR (
                             SELECT COUNT(*)
-                            FROM `checkins` AS `chex2`
+                            FROM `{db}`.`checkins` AS `chex2`
                             WHERE
                                 `chex2`.`ticket_number` = `tix1`.`ticket_number`
                                 AND `chex2`.`ticket_code` = `tix1`.`ticket_code`
@@ -374,7 +425,7 @@ class MainWindow(wx.Frame):
                 OR (
                     (
                         SELECT `chex3`.`ticket_id`
-                        FROM `checkins` as `chex3`
+                        FROM `{db}`.`checkins` as `chex3`
                         WHERE
                             `chex3`.`ticket_number` = `tix1`.`ticket_number`
                             AND `chex3`.`ticket_code` = `tix1`.`ticket_code`
@@ -383,9 +434,12 @@ class MainWindow(wx.Frame):
                     ) = `tix1`.`id`
                 ))
             ORDER BY waiver_name'''
-        cursor.execute(sql_search, (query_string, query_string, query_string, query_string))
-        search_results = cursor.fetchall()
+        search_results = []
+        for db in self.shards.schemas():
+            cursor.execute(sql_search.format(db=db), (query_string, query_string, query_string, query_string))
+            search_results.extend(cursor.fetchall())
         cursor.close()
+        search_results.sort(key=lambda ticket: ticket['waiver_name'] or '')
  
         if self.display_tickets(search_results) == False:
             self.set_status(STATUS_ERROR, 'Search returned 0 results!')
@@ -396,13 +450,17 @@ class MainWindow(wx.Frame):
     def search_wristbands(self, searchfilter):
         cursor = self.ticket_db.cursor()
         sql_search = '''SELECT `tickets`.*
-            FROM `tickets`, `checkins`
+            FROM `{db}`.`tickets`, `{db}`.`checkins`
             WHERE
                 `checkins`.`ticket_id` = `tickets`.`id`
                 AND `checkins`.`wristband` = ?
             LIMIT 1'''
-        cursor.execute(sql_search, (searchfilter,))
-        search_results = cursor.fetchall()
+        search_results = []
+        for db in self.shards.schemas():
+            cursor.execute(sql_search.format(db=db), (searchfilter,))
+            search_results = cursor.fetchall()
+            if search_results:
+                break
         cursor.close()
         
         if self.display_tickets(search_results) == False:
@@ -429,19 +487,7 @@ class MainWindow(wx.Frame):
         return (t > 0)
 
     def set_stats(self):
-        tickets_sold = 0
-        tickets_used = 0
-
-        cursor = self.ticket_db.cursor()
-        sql_sold = '''SELECT COUNT(*) FROM (SELECT DISTINCT `ticket_number`, `ticket_code`, `tier_code` FROM `tickets`)'''
-        sql_used = '''SELECT COUNT(DISTINCT `ticket_id`) FROM `checkins`'''
-        cursor.execute(sql_sold)
-        res_sold = cursor.fetchone()
-        tickets_sold = int(res_sold[0])
-        cursor.execute(sql_used)
-        res_used = cursor.fetchone()
-        tickets_used = int(res_used[0])
-        cursor.close()
+        tickets_sold, tickets_used = bs_api.count_tickets(self.ticket_db, self.shards.schemas())
 
         self.statictext_soldvalue.SetLabel(str(tickets_sold))
         self.statictext_usedvalue.SetLabel(str(tickets_used))
@@ -452,10 +498,12 @@ class MainWindow(wx.Frame):
         check_tier_code = code[0]
         check_ticket_number = code[1:6]
         check_ticket_code = code[6:10]
-        
+
+        # the tier code picks the shard, so only that file (and any
+        # pre-sharding rows) is searched
         cursor = self.ticket_db.cursor()
         sql_ticket = '''SELECT *
-            FROM `tickets` AS `tix1`
+            FROM `{db}`.`tickets` AS `tix1`
             WHERE
             (
                 `tix1`.`tier_code` = ?
@@ -465,7 +513,7 @@ class MainWindow(wx.Frame):
             AND ((
                     `tix1`.`id` = (
                         SELECT MAX(`tix2`.`id`)
-                        FROM `tickets` as `tix2`
+                        FROM `{db}`.`tickets` as `tix2`
                         WHERE
                             `tix2`.`ticket_number` = `tix1`.`ticket_number`
                             AND `tix2`.`ticket_code` = `tix1`.`ticket_code`
@@ -474,7 +522,7 @@ class MainWindow(wx.Frame):
                     AND (
                         (
                             SELECT `chex1`.`ticket_id`
-                            FROM `checkins` AS `chex1`
+                            FROM `{db}`.`checkins` AS `chex1`
                             WHERE
                                 `chex1`.`ticket_number` = `tix1`.`ticket_number`
                                 AND `chex1`.`ticket_code` = `tix1`.`ticket_code`
@@ -483,7 +531,7 @@ class MainWindow(wx.Frame):
                         ) = `tix1`.`id`
                         OR (
                             SELECT COUNT(*)
-                            FROM `checkins` AS `chex2`
+                            FROM `{db}`.`checkins` AS `chex2`
                             WHERE
                                 `chex2`.`ticket_number` = `tix1`.`ticket_number`
                                 AND `chex2`.`ticket_code` = `tix1`.`ticket_code`
@@ -494,7 +542,7 @@ class MainWindow(wx.Frame):
                 OR (
                     (
                         SELECT `chex3`.`ticket_id`
-                        FROM `checkins` as `chex3`
+                        FROM `{db}`.`checkins` as `chex3`
                         WHERE
                             `chex3`.`ticket_number` = `tix1`.`ticket_number`
                             AND `chex3`.`ticket_code` = `tix1`.`ticket_code`
@@ -503,8 +551,12 @@ class MainWindow(wx.Frame):
                     ) = `tix1`.`id`
                 ))
             LIMIT 1'''
-        cursor.execute(sql_ticket, (check_tier_code, check_ticket_number, check_ticket_code))
-        ticket = cursor.fetchone()
+        ticket = None
+        for db in self.shards.lookup_schemas(check_tier_code):
+            cursor.execute(sql_ticket.format(db=db), (check_tier_code, check_ticket_number, check_ticket_code))
+            ticket = cursor.fetchone()
+            if ticket is not None:
+                break
         cursor.close()
 
         if ticket is None:
@@ -514,25 +566,25 @@ class MainWindow(wx.Frame):
         
         ticket_id = ticket['id']
 
-        return self.check_ticket(ticket_id)
+        return self.check_ticket(ticket_id, db)
     
-    def check_ticket(self, ticket_id):
+    def check_ticket(self, ticket_id, db):
         ticket_cursor = self.ticket_db.cursor()
         sql_ticket = '''SELECT `tickets`.*,
             (SELECT COUNT(*)
-                FROM `checkins`
+                FROM `{db}`.`checkins`
                 WHERE `checkins`.`ticket_id` = `tickets`.`id`
             ) AS `wristband_count`,
             (SELECT `wristband`
-                FROM `checkins`
+                FROM `{db}`.`checkins`
                 WHERE `checkins`.`ticket_id` = `tickets`.`id`
                 ORDER BY `checkins`.`date` DESC
                 LIMIT 1
             ) AS `wristband_current`
-            FROM `tickets`
+            FROM `{db}`.`tickets`
             WHERE `id` = ?
             LIMIT 1'''
-        ticket_cursor.execute(sql_ticket, (ticket_id,))
+        ticket_cursor.execute(sql_ticket.format(db=db), (ticket_id,))
         ticket = ticket_cursor.fetchone()
         ticket_cursor.close()
 
@@ -577,11 +629,11 @@ class MainWindow(wx.Frame):
             return False
 
         checkin_cursor = self.ticket_db.cursor()
-        sql_checkin = '''INSERT INTO `checkins`
+        sql_checkin = '''INSERT INTO `{db}`.`checkins`
             (`ticket_id`,`date`,`wristband`,`ticket_number`, `ticket_code`, `tier_code`)
             VALUES (?, ?, ?, ?, ?, ?)'''
         date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        checkin_cursor.execute(sql_checkin, (
+        checkin_cursor.execute(sql_checkin.format(db=db), (
             ticket_id, date, wristband_id, ticket['ticket_number'],
             ticket['ticket_code'], ticket['tier_code']))
         checkin_cursor.close()
@@ -635,70 +687,18 @@ class MainWindow(wx.Frame):
             self.textctrl_code.SetFocus()
         return True
 
-    def query_server(self, request):
-        json_request = json.dumps(request)
-        box_server = Box(self.client_private_key, self.server_public_key)
-        bin_request = box_server.encrypt(json_request.encode('utf-8'))
-        io_buffer = BytesIO()
-        curl_query = pycurl.Curl()
-        curl_query.setopt(curl_query.URL, self.api_path)
-        b64_request = base64.b64encode(bin_request)
-        post_data = {'i': self.client_ident, 'r': b64_request}
-        post_fields = urlencode(post_data)
-        curl_query.setopt(curl_query.POSTFIELDS, post_fields)
-        curl_query.setopt(curl_query.WRITEDATA, io_buffer)
-        curl_query.setopt(curl_query.CAINFO, certifi.where())
-        try:
-            curl_query.perform()
-            curl_query.close()
-        except pycurl.error:
-            return False;
-        cip_response = base64.b64decode(io_buffer.getvalue())
-        bin_response = box_server.decrypt(cip_response)
-        json_response = bin_response.decode('utf-8')
-        obj_response = json.loads(json_response)
-        return obj_response
-        
-
     def update_api(self, e):
-        last_cursor = self.ticket_db.cursor()
-        sql_last = '''SELECT `id` FROM `tickets` ORDER BY `id` DESC LIMIT 1'''
-        last_cursor.execute(sql_last)
-        last_ticket = last_cursor.fetchone()
-        last_cursor.close()
-        if last_ticket is None:
-            ticket_id = 0
-        else:
-            ticket_id = last_ticket['id']
-        arr_request = {'command': 'update', 'id': ticket_id}
-        api_response = self.query_server(arr_request)
-        if api_response == False:
+        if not bs_api.update_tickets(self.ticket_db, self.api_client, self.shards):
             return False
-        if len(api_response) < 1:
-            return True
-        insert_template = '''INSERT INTO `tickets`
-            (`id`, `import_id`, `ticket_number`, `ticket_code`,`tier_id`,
-            `tier_code`, `tier_label`, `purchase_date`, `purchase_email`,
-            `purchase_name`, `assigned_email`, `waiver_name`, `waiver_state`,
-            `waiver_emergency`)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
-        update_cursor = self.ticket_db.cursor()
-        for ticket in api_response:
-            update_cursor.execute(insert_template,
-                (ticket['id'], ticket['import_id'], ticket['ticket_number'],
-                ticket['ticket_code'], ticket['tier_id'], ticket['tier_code'],
-                ticket['tier_label'], ticket['purchase_date'], ticket['purchase_email'],
-                ticket['purchase_name'], ticket['assigned_email'], ticket['waiver_name'],
-                ticket['waiver_state'], ticket['waiver_emergency']))
-        update_cursor.close()
-        self.ticket_db.commit()
         self.set_stats()
         return True
 
 argparser = argparse.ArgumentParser(description='BurnScan Ticket Station')
+argparser.add_argument('--config', default=CFG_PATH, help='Config file to load.')
 argparser.add_argument('--flush-tickets', action='store_true', help='Flush the ticket table.')
 argparser.add_argument('--flush-wristbands', action='store_true', help='Flush the wristband table.')
 argparser.add_argument('--flush-all', action='store_true', help='Flush the entire database.')
+argparser.add_argument('--archive-event', metavar='EVENT', help='Move an inactive event\'s shard files into the archive folder.')
 
 pygame.init()
 app = wx.App()
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+
+"""
+    BurnScan checkin export and gate throughput report
+    Copyright (C) 2010 Ben Sarsgard
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import os.path
+import sqlite3
+import sys
+import tempfile
+
+import configparser
+from urllib.request import pathname2url
+
+import bs_shards
+
+CFG_PATH = 'BurnScan.cfg'
+
+CFG_SECTION_SECURITY = 'Security'
+CFG_CLIENT_IDENT = 'client_ident'
+
+CFG_SECTION_DATA = 'Data'
+CFG_DATABASE_PATH = 'database_path'
+CFG_SHARD_DIR = 'shard_dir'
+CFG_SHARD_EVENT = 'shard_event'
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+
+EXPORT_FIELDS = ['station', 'shard', 'checkin_id', 'date', 'wristband', 'ticket',
+    'tier_code', 'tier_label', 'waiver_name', 'waiver_state']
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_SNAPSHOT_PAGES = 256
+DEFAULT_SNAPSHOT_SLEEP = 0.05
+
+
+def open_readonly(db_path):
+    # mode=ro keeps the report from ever changing station data, but a reader
+    # still holds a shared lock that blocks commits under the rollback
+    # journal, so only open_snapshot should read the live file
+    db_uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(db_path))
+    db = sqlite3.connect(db_uri, uri=True)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def open_snapshot(db_path, pages=DEFAULT_SNAPSHOT_PAGES, sleep=DEFAULT_SNAPSHOT_SLEEP):
+    # copy the live file a few pages at a time; the read lock is dropped
+    # between steps so check_ticket commits are only ever delayed by one step
+    source = open_readonly(db_path)
+    snapshot_fd, snapshot_path = tempfile.mkstemp(suffix='.db', prefix='bs_snapshot_')
+    os.close(snapshot_fd)
+    snapshot = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(snapshot, pages=pages, sleep=sleep)
+    except Exception:
+        snapshot.close()
+        os.remove(snapshot_path)
+        raise
+    finally:
+        source.close()
+    snapshot.row_factory = sqlite3.Row
+    return snapshot, snapshot_path
+
+
+def iter_checkins(db, chunk_size=DEFAULT_CHUNK_SIZE):
+    cursor = db.cursor()
+    sql_checkins = '''SELECT `checkins`.`id` AS `checkin_id`,
+            `checkins`.`date`,
+            `checkins`.`wristband`,
+            `checkins`.`ticket_number`,
+            `checkins`.`ticket_code`,
+            `checkins`.`tier_code`,
+            `tickets`.`tier_label`,
+            `tickets`.`waiver_name`,
+            `tickets`.`waiver_state`
+        FROM `checkins`
+        LEFT JOIN `tickets` ON `tickets`.`id` = `checkins`.`ticket_id`
+        ORDER BY `checkins`.`date`, `checkins`.`id`'''
+    cursor.execute(sql_checkins)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+
+def iter_shard(station, shard, db, chunk_size=DEFAULT_CHUNK_SIZE):
+    for checkin in iter_checkins(db, chunk_size):
+        yield station, shard, checkin
+
+
+def checkin_order(item):
+    station, shard, checkin = item
+    return (str(checkin['date'] or ''), station, shard, checkin['checkin_id'])
+
+
+class ThroughputSummary(object):
+    def __init__(self):
+        self.total = 0
+        self.per_minute = {}
+        self.per_station = {}
+        self.per_tier = {}
+        self.tier_labels = {}
+
+    def add(self, station, checkin):
+        minute = str(checkin['date'])[:16]
+        tier_code = checkin['tier_code']
+        self.total += 1
+        self.per_minute[minute] = self.per_minute.get(minute, 0) + 1
+        self.per_station[station] = self.per_station.get(station, 0) + 1
+        self.per_tier[tier_code] = self.per_tier.get(tier_code, 0) + 1
+        if checkin['tier_label'] is not None:
+            self.tier_labels[tier_code] = checkin['tier_label']
+
+    def peak_minute(self):
+        if not self.per_minute:
+            return None, 0
+        minute = max(sorted(self.per_minute), key=lambda m: self.per_minute[m])
+        return minute, self.per_minute[minute]
+
+    def average_per_minute(self):
+        if not self.per_minute:
+            return 0.0
+        return float(self.total) / len(self.per_minute)
+
+    def as_dict(self):
+        peak_minute, peak_count = self.peak_minute()
+        return {
+            'total': self.total,
+            'active_minutes': len(self.per_minute),
+            'average_per_minute': round(self.average_per_minute(), 2),
+            'peak_minute': peak_minute,
+            'peak_count': peak_count,
+            'per_minute': [{'minute': m, 'entries': self.per_minute[m]}
+                for m in sorted(self.per_minute)],
+            'per_station': [{'station': s, 'entries': self.per_station[s]}
+                for s in sorted(self.per_station)],
+            'per_tier': [{'tier_code': t, 'tier_label': self.tier_labels.get(t),
+                'entries': self.per_tier[t]} for t in sorted(self.per_tier)],
+        }
+
+    def write_text(self, stream):
+        peak_minute, peak_count = self.peak_minute()
+        stream.write('Entries: %i\n' % self.total)
+        stream.write('Active minutes: %i\n' % len(self.per_minute))
+        stream.write('Average per active minute: %.2f\n' % self.average_per_minute())
+        if peak_minute is not None:
+            stream.write('Peak minute: %s (%i entries)\n' % (peak_minute, peak_count))
+        stream.write('\n#### PER STATION ####\n')
+        for station in sorted(self.per_station):
+            stream.write('%-30s %8i\n' % (station, self.per_station[station]))
+        stream.write('\n#### PER TIER ####\n')
+        for tier_code in sorted(self.per_tier):
+            tier_name = '%s %s' % (tier_code, self.tier_labels.get(tier_code, ''))
+            stream.write('%-30s %8i\n' % (tier_name.strip(), self.per_tier[tier_code]))
+        stream.write('\n#### PER MINUTE ####\n')
+        for minute in sorted(self.per_minute):
+            stream.write('%-30s %8i\n' % (minute, self.per_minute[minute]))
+
+
+class CheckinWriter(object):
+    def __init__(self, stream, export_format):
+        self.stream = stream
+        self.export_format = export_format
+        if export_format == FORMAT_CSV:
+            self.csv_writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, station, shard, checkin):
+        record = {
+            'station': station,
+            'shard': shard,
+            'checkin_id': checkin['checkin_id'],
+            'date': checkin['date'],
+            'wristband': checkin['wristband'],
+            'ticket': '%i%05i%04i' % (int(checkin['tier_code']),
+                int(checkin['ticket_number']), int(checkin['ticket_code'])),
+            'tier_code': checkin['tier_code'],
+            'tier_label': checkin['tier_label'],
+            'waiver_name': checkin['waiver_name'],
+            'waiver_state': checkin['waiver_state'],
+        }
+        if self.export_format == FORMAT_CSV:
+            self.csv_writer.writerow(record)
+        else:
+            self.stream.write(json.dumps(record) + '\n')
+
+
+def load_stations(args):
+    config = configparser.RawConfigParser()
+    config.read(args.config)
+
+    # each scanner keeps its own tickets.db, so a station is one database file
+    if args.database:
+        stations = []
+        for db_path in args.database:
+            station, _, path = db_path.rpartition('=')
+            if not station:
+                station = os.path.splitext(os.path.basename(path))[0]
+            stations.append((station, path))
+        return stations
+
+    if not config.has_option(CFG_SECTION_DATA, CFG_DATABASE_PATH):
+        print("Error loading config: no database_path in {0}".format(args.config), file=sys.stderr)
+        sys.exit(1)
+    db_path = config.get(CFG_SECTION_DATA, CFG_DATABASE_PATH)
+    if config.has_option(CFG_SECTION_SECURITY, CFG_CLIENT_IDENT):
+        station = config.get(CFG_SECTION_SECURITY, CFG_CLIENT_IDENT)
+    else:
+        station = os.path.splitext(os.path.basename(db_path))[0]
+
+    # a sharded station keeps its checkins in the active event's shard files
+    if config.has_option(CFG_SECTION_DATA, CFG_SHARD_DIR):
+        if not config.has_option(CFG_SECTION_DATA, CFG_SHARD_EVENT):
+            print("Error loading config: shard_dir is set but shard_event is missing", file=sys.stderr)
+            sys.exit(1)
+        shard_event = config.get(CFG_SECTION_DATA, CFG_SHARD_EVENT)
+        try:
+            bs_shards.check_event_name(shard_event)
+        except ValueError as err:
+            print("Error loading config: {0}".format(err), file=sys.stderr)
+            sys.exit(1)
+        shard_paths = bs_shards.event_shard_paths(
+            config.get(CFG_SECTION_DATA, CFG_SHARD_DIR), shard_event)
+        if not shard_paths:
+            print("Error loading config: no shard files for the active event in {0}".format(
+                config.get(CFG_SECTION_DATA, CFG_SHARD_DIR)), file=sys.stderr)
+            sys.exit(1)
+        return [(station, shard_path) for shard_path in shard_paths]
+    return [(station, db_path)]
+
+
+def run_report(args):
+    summary = ThroughputSummary()
+
+    if args.output == '-':
+        output_stream = sys.stdout
+    elif args.output:
+        output_stream = open(args.output, 'w', newline='')
+    else:
+        output_stream = None
+
+    writer = None
+    if output_stream is not None:
+        writer = CheckinWriter(output_stream, args.format)
+
+    snapshots = []
+    try:
+        for station, db_path in load_stations(args):
+            try:
+                db, snapshot_path = open_snapshot(db_path)
+            except sqlite3.Error as err:
+                print("Error loading database {0}: {1}".format(db_path, err), file=sys.stderr)
+                sys.exit(1)
+            shard = os.path.splitext(os.path.basename(db_path))[0]
+            snapshots.append((station, shard, db, snapshot_path))
+
+        # checkin ids are only unique within one file, so every row carries its
+        # shard, and the per-file streams are merged back into date order
+        streams = [iter_shard(station, shard, db, args.chunk_size)
+            for station, shard, db, snapshot_path in snapshots]
+        for station, shard, checkin in heapq.merge(*streams, key=checkin_order):
+            if writer is not None:
+                writer.write(station, shard, checkin)
+            summary.add(station, checkin)
+    finally:
+        for station, shard, db, snapshot_path in snapshots:
+            db.close()
+            os.remove(snapshot_path)
+        if output_stream is not None and output_stream is not sys.stdout:
+            output_stream.close()
+
+    if args.summary_json:
+        with open(args.summary_json, 'w') as summary_file:
+            json.dump(summary.as_dict(), summary_file, indent=2)
+
+    # keep stdout clean for the export when it is being streamed there
+    summary_stream = sys.stderr if output_stream is sys.stdout else sys.stdout
+    summary.write_text(summary_stream)
+    return summary
+
+
+argparser = argparse.ArgumentParser(description='BurnScan Checkin Report')
+argparser.add_argument('--config', default=CFG_PATH, help='Config file to read the database path from.')
+argparser.add_argument('--database', action='append', metavar='[STATION=]PATH', help='Station database to report on; may be repeated. Overrides the config.')
+argparser.add_argument('--output', help='Export checkins to this file, or - for stdout.')
+argparser.add_argument('--format', choices=[FORMAT_CSV, FORMAT_JSONL], default=FORMAT_CSV, help='Export format.')
+argparser.add_argument('--summary-json', help='Also write the throughput summary as JSON to this file.')
+argparser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows fetched per chunk.')
+
+if __name__ == '__main__':
+    run_report(argparser.parse_args())
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+
+"""
+    BurnScan per-event ticket database shards
+    Copyright (C) 2010 Ben Sarsgard
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import os.path
+import shutil
+import sqlite3
+
+MAIN_SCHEMA = 'main'
+LEGACY_SCHEMA = 'legacy'
+SHARD_ARCHIVE_DIR = 'archive'
+SHARD_TABLES = ('tickets', 'checkins')
+
+DEFAULT_LEGACY_EVENT = 'legacy'
+
+# tier codes are the first digit of the barcode, so there are at most ten
+# tier shards; sqlite attaches ten databases by default, one of which may be
+# the legacy event, which is plenty for the handful of tiers sold in practice
+TIER_CODES = range(10)
+
+def check_event_name(event):
+    # event names become file names inside shard_dir, so keep them there
+    separators = [sep for sep in (os.sep, os.altsep, '/') if sep]
+    if not event or event in (os.curdir, os.pardir) or any(sep in event for sep in separators):
+        raise ValueError('invalid event name "%s"' % event)
+    return event
+
+def shard_path(shard_dir, event, tier_code=None):
+    if tier_code is None:
+        return os.path.join(shard_dir, '%s.db' % event)
+    return os.path.join(shard_dir, '%s_tier%i.db' % (event, int(tier_code)))
+
+def event_shard_paths(shard_dir, event):
+    paths = []
+    for tier_code in [None] + list(TIER_CODES):
+        path = shard_path(shard_dir, event, tier_code)
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
+
+def archive_event(shard_dir, event):
+    archive_dir = os.path.join(shard_dir, SHARD_ARCHIVE_DIR)
+    paths = event_shard_paths(shard_dir, event)
+    if not paths:
+        raise OSError('no shard files for event "%s" in %s' % (event, shard_dir))
+    # check every destination first so a clash never leaves an event half moved
+    for path in paths:
+        archive_path = os.path.join(archive_dir, os.path.basename(path))
+        if os.path.exists(archive_path):
+            raise OSError('%s is already archived' % archive_path)
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+    for path in paths:
+        shutil.move(path, os.path.join(archive_dir, os.path.basename(path)))
+    return len(paths)
+
+class ShardSet(object):
+    def __init__(self, ticket_db, shard_dir=None, event=None, by_tier=False,
+            legacy_event=DEFAULT_LEGACY_EVENT):
+        self.ticket_db = ticket_db
+        self.shard_dir = shard_dir
+        self.event = event
+        self.by_tier = by_tier
+        self.legacy_event = legacy_event
+        self.legacy_schema = None
+        self.attached = {}
+
+        if self.shard_dir is None:
+            return
+        if self.legacy_event == self.event:
+            raise ValueError('shard_legacy_event must differ from shard_event')
+        if not os.path.isdir(self.shard_dir):
+            os.makedirs(self.shard_dir)
+
+        # switching shard_by_tier mid-event would hide the other layout's files
+        event_paths = event_shard_paths(self.shard_dir, self.event)
+        event_path = shard_path(self.shard_dir, self.event)
+        if self.by_tier and event_path in event_paths:
+            raise ValueError('%s exists but shard_by_tier is on' % event_path)
+        if not self.by_tier and [path for path in event_paths if path != event_path]:
+            raise ValueError('per-tier shards exist for event "%s" but shard_by_tier is off' % self.event)
+
+        if self.by_tier:
+            for tier_code in TIER_CODES:
+                if os.path.exists(shard_path(self.shard_dir, self.event, tier_code)):
+                    self.attach(tier_code)
+        else:
+            self.schema_for_tier(None, create=True)
+        self.migrate_main()
+
+        # the legacy event stays searchable until it is archived
+        legacy_path = shard_path(self.shard_dir, self.legacy_event)
+        if self.legacy_schema is None and os.path.exists(legacy_path):
+            self.legacy_schema = self.attach_file(LEGACY_SCHEMA, legacy_path)
+
+    def is_sharded(self):
+        return self.shard_dir is not None
+
+    def schemas(self):
+        if not self.is_sharded():
+            return [MAIN_SCHEMA]
+        schemas = [self.attached[key] for key in sorted(self.attached, key=str)]
+        if self.legacy_schema is not None:
+            schemas.append(self.legacy_schema)
+        return schemas
+
+    def lookup_schemas(self, tier_code):
+        # the tier's own shard first, then any pre-sharding rows
+        schemas = []
+        schema = self.schema_for_tier(tier_code)
+        if schema is not None:
+            schemas.append(schema)
+        if self.legacy_schema is not None:
+            schemas.append(self.legacy_schema)
+        return schemas
+
+    def schema_for_tier(self, tier_code, create=False):
+        if not self.is_sharded():
+            return MAIN_SCHEMA
+        key = int(tier_code) if self.by_tier else None
+        if key in self.attached:
+            return self.attached[key]
+        path = shard_path(self.shard_dir, self.event, key)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            self.create_shard(path)
+        return self.attach(key)
+
+    def create_shard(self, path):
+        # new shards copy the table layout of the main database
+        cursor = self.ticket_db.cursor()
+        sql_schema = '''SELECT `sql` FROM `main`.`sqlite_master`
+            WHERE `tbl_name` IN (?, ?) AND `sql` IS NOT NULL
+            ORDER BY CASE `type` WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END'''
+        cursor.execute(sql_schema, SHARD_TABLES)
+        schema = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        if not schema:
+            raise sqlite3.OperationalError('main database has no tickets/checkins tables to copy')
+        shard_db = sqlite3.connect(path)
+        try:
+            for sql in schema:
+                shard_db.execute(sql)
+            shard_db.commit()
+        finally:
+            shard_db.close()
+
+    def attach(self, key):
+        if key is None:
+            schema = 'shard'
+        else:
+            schema = 'shard_tier%i' % key
+        self.attached[key] = self.attach_file(schema, shard_path(self.shard_dir, self.event, key))
+        return schema
+
+    def attach_file(self, schema, path):
+        # ATTACH is refused inside a transaction, so close out any pending one
+        self.ticket_db.commit()
+        self.ticket_db.execute('''ATTACH DATABASE ? AS `%s`''' % schema, (path,))
+        return schema
+
+    def has_rows(self, schema):
+        cursor = self.ticket_db.cursor()
+        rows = 0
+        for table in SHARD_TABLES:
+            cursor.execute('''SELECT COUNT(*) FROM (SELECT 1 FROM `%s`.`%s` LIMIT 1)''' % (schema, table))
+            rows += int(cursor.fetchone()[0])
+        cursor.close()
+        return rows > 0
+
+    def migrate_main(self):
+        # rows left in the main database from before sharding was switched on
+        # may span several years, so they move into their own legacy event
+        # file, which stays searchable and can be archived like any other
+        if not self.has_rows(MAIN_SCHEMA):
+            return
+        legacy_path = shard_path(self.shard_dir, self.legacy_event)
+        if os.path.exists(legacy_path):
+            raise ValueError('the main database holds rows but %s already exists; '
+                'archive it with --archive-event %s, or turn sharding off to flush '
+                'the main database with the --flush flags' % (legacy_path, self.legacy_event))
+
+        self.create_shard(legacy_path)
+        self.legacy_schema = self.attach_file(LEGACY_SCHEMA, legacy_path)
+
+        cursor = self.ticket_db.cursor()
+        sql_copy = '''INSERT INTO `{db}`.`{table}` SELECT * FROM `main`.`{table}`'''
+        try:
+            for table in SHARD_TABLES:
+                cursor.execute(sql_copy.format(db=self.legacy_schema, table=table))
+            for table in SHARD_TABLES:
+                cursor.execute('''DELETE FROM `main`.`%s`''' % table)
+        except Exception:
+            # leave no half-filled legacy file behind to block the next start
+            self.ticket_db.rollback()
+            self.ticket_db.execute('''DETACH DATABASE `%s`''' % self.legacy_schema)
+            self.legacy_schema = None
+            os.remove(legacy_path)
+            raise
+        finally:
+            cursor.close()
+        self.ticket_db.commit()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+"""
+    BurnScan ticket sync benchmark
+    Copyright (C) 2010 Ben Sarsgard
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import bs_api
+import bs_fakeserver
+
+DEFAULT_MAX_UPDATES = 50
+
+# bs_form fires update_api from a wx.Timer every five minutes
+UPDATE_PERIOD = 60 * 5
+
+def run_profile(profile, args):
+    fake_server = bs_fakeserver.FakeApiServer(profile=profile,
+        ticket_count=args.tickets, batch_size=args.batch_size).start()
+    keys = fake_server.encoded_keys()
+    api_client = bs_api.ApiClient(fake_server.api_path, keys['client_ident'],
+        keys['client_private_key'], keys['server_public_key'],
+        connect_timeout=args.timeout, timeout=args.timeout)
+
+    # a real file, so commits pay the same journal and fsync cost as a station
+    db_dir = tempfile.mkdtemp(prefix='bs_syncbench_')
+    db_path = os.path.join(db_dir, 'tickets.db')
+    bs_fakeserver.create_database(db_path)
+    ticket_db = sqlite3.connect(db_path)
+
+    # each update_api tick runs on the UI thread: the sync plus set_stats
+    updates = 0
+    failures = 0
+    blocked_max = 0.0
+    synced = 0
+    sync_start = time.time()
+    try:
+        while synced < args.tickets and updates < args.max_updates:
+            update_start = time.time()
+            ok = bs_api.update_tickets(ticket_db, api_client)
+            if ok:
+                synced = bs_api.count_tickets(ticket_db)[0]
+            blocked_max = max(blocked_max, time.time() - update_start)
+            updates += 1
+            if not ok:
+                failures += 1
+                if failures >= args.max_failures:
+                    break
+    finally:
+        sync_duration = time.time() - sync_start
+        ticket_db.close()
+        fake_server.stop()
+        shutil.rmtree(db_dir)
+
+    return {
+        'profile': profile,
+        'synced': synced,
+        'updates': updates,
+        'failures': failures,
+        'duration': sync_duration,
+        'bytes_sent': api_client.bytes_sent,
+        'bytes_received': api_client.bytes_received,
+        'network': api_client.request_seconds,
+        'local': sync_duration - api_client.request_seconds,
+        'blocked_max': blocked_max,
+        'blocked_share': blocked_max / UPDATE_PERIOD,
+    }
+
+def print_results(results):
+    header = '%-10s %8s %7s %8s %10s %10s %10s %10s %10s %11s %9s'
+    row = '%-10s %8i %7i %8i %9.2fs %10i %10i %9.2fs %9.2fs %10.2fs %8.2f%%'
+    print(header % ('profile', 'tickets', 'updates', 'failures', 'duration',
+        'sent', 'received', 'network', 'local', 'worst tick', 'of 5 min'))
+    for result in results:
+        print(row % (result['profile'], result['synced'], result['updates'],
+            result['failures'], result['duration'], result['bytes_sent'],
+            result['bytes_received'], result['network'], result['local'],
+            result['blocked_max'], result['blocked_share'] * 100))
+
+argparser = argparse.ArgumentParser(description='BurnScan Sync Benchmark')
+argparser.add_argument('--profile', action='append', choices=sorted(bs_fakeserver.NETWORK_PROFILES), help='Profile to run; may be repeated. Defaults to all.')
+argparser.add_argument('--tickets', type=int, default=bs_fakeserver.DEFAULT_TICKET_COUNT, help='Number of tickets to sync.')
+argparser.add_argument('--batch-size', type=int, default=bs_fakeserver.DEFAULT_BATCH_SIZE, help='Tickets per update response, 0 for all.')
+argparser.add_argument('--timeout', type=int, default=bs_api.DEFAULT_TIMEOUT, help='Client timeout in seconds.')
+argparser.add_argument('--max-updates', type=int, default=DEFAULT_MAX_UPDATES, help='Give up a profile after this many update calls.')
+argparser.add_argument('--max-failures', type=int, default=3, help='Give up a profile after this many failed updates.')
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    profiles = args.profile or sorted(bs_fakeserver.NETWORK_PROFILES)
+    print_results([run_profile(profile, args) for profile in profiles])